@@ -2,7 +2,7 @@
 """
 QQ企业邮箱 → Telegram 验证码转发服务 (最终修复版)
 版本: 1.4.1 | 专为 Koyeb 部署优化
-功能: 1.精准验证码识别 2.银行卡号提取 3.双重防休眠 4.完整监控
+功能: 1.精准验证码识别 2.银行卡号提取 3.IDLE实时推送 4.完整监控
 """
 
 import os
@@ -12,17 +12,31 @@ import imaplib
 import email
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import threading
-import random
 import json
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Tuple
-from dataclasses import dataclass
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from email.header import decode_header
+import html
+import hashlib
+import select
+import signal
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+import base64
+import quopri
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple, Union
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email import policy
+from email.header import Header, decode_header, make_header
+from email.errors import MessageError
+from email.parser import BytesHeaderParser
 from email.utils import parsedate_to_datetime
-import pytz
+from zoneinfo import ZoneInfo
 from enum import Enum
 import ssl
 
@@ -34,15 +48,48 @@ class Config:
     IMAP_PORT = 993
     IMAP_TIMEOUT = 15
     IMAP_SSL = True
+    IDLE_TIMEOUT = 9 * 60  # IDLE 单次最长等待（秒）；RFC 2177 上限为29分钟，部分服务器约10分钟即断开，取9分钟
+    IMAP_RECYCLE_INTERVAL = 3600  # 长连接最长使用时间（秒），到期后主动重建
+    # TCP 保活：空闲60秒后开始探测，每30秒一次，连续3次无响应判定断开（约2.5分钟发现 NAT 失效）
+    TCP_KEEPIDLE = 60
+    TCP_KEEPINTVL = 30
+    TCP_KEEPCNT = 3
     
     # 健康检查
     HEALTH_PORT = 8000
     HEALTH_HOST = "0.0.0.0"
     
     # 时间设置
-    BEIJING_TZ = pytz.timezone("Asia/Shanghai")
+    BEIJING_TZ = ZoneInfo("Asia/Shanghai")
     CHECK_INTERVAL = 15  # 邮件检查间隔（秒）
-    SELF_PING_INTERVAL = 280  # 自我唤醒间隔（秒），略小于5分钟
+    
+    # 验证码搜索范围（字符数）
+    CODE_SEARCH_CHARS = 2000
+    
+    # 邮件搜索：只查找最近几天的未读邮件（留出时区余量）
+    SEARCH_SINCE_DAYS = 1
+    # 需要获取的邮件头字段
+    HEADER_FIELDS = "SUBJECT FROM DATE MESSAGE-ID"
+    # 正文只获取前若干字节（覆盖验证码搜索范围，考虑多字节字符和 base64 膨胀）
+    BODY_FETCH_BYTES = 8192
+    # 无法使用 BODYSTRUCTURE 时整封获取的上限（避免下载大附件、内嵌图片）
+    FULL_FETCH_BYTES = 65536
+    
+    # 最近转发过的邮件数量（按 Message-ID 去重，防止标记已读失败后重复转发）
+    FORWARDED_CACHE_SIZE = 512
+    # 相同标题和验证码在该时间内（秒）视为重复投递，不再转发
+    DUPLICATE_CODE_WINDOW = 600
+    # 最近处理过的 UID 数量（标记已读失败时不再重复获取）
+    HANDLED_UID_CACHE_SIZE = 10000
+    # 已处理邮件的最大 UID 持久化文件（重启后只搜索之后到达的邮件）
+    LAST_UID_FILE = "/tmp/last_uid"
+    
+    # Telegram 设置
+    TELEGRAM_TIMEOUT = 10  # 单次请求超时（秒）
+    TELEGRAM_SEND_INTERVAL = 1.05  # 同一会话两次发送的最小间隔（秒），Telegram 限制约1条/秒
+    TELEGRAM_MAX_RETRIES = 3  # 被限流(429)后的最大重试次数
+    TELEGRAM_GLOBAL_RATE = 30  # 全局每秒最多发送条数（Telegram 限制约30条/秒）
+    TELEGRAM_GLOBAL_BURST = 20  # 全局允许的突发条数
     
     # 监控设置
     MAX_ERROR_COUNT = 5
@@ -52,10 +99,11 @@ class Config:
     CODE_PATTERNS = [
         # ==== 针对中文HTML邮件的精准规则 ====
         # 规则1: 匹配"验证码"文本后出现的第一个6位数字（无论中间有什么HTML）
-        r'(?:验证码[^<]*</p>)[^<]*(?:<div[^>]*>)[^0-9]*(\d{6})',
+        # （重复部分均限定长度，避免恶意长文本导致回溯耗时）
+        r'(?:验证码[^<]{0,200}</p>)[^<]{0,200}(?:<div[^>]{0,500}>)[^0-9]{0,500}(\d{6})',
         
         # 规则2: 匹配在"验证码"文本后，且被<div>包裹的6位数字
-        r'验证码[^<]*</p>\s*<div[^>]*>\s*(\d{6})\s*</div>',
+        r'验证码[^<]{0,200}</p>\s{0,50}<div[^>]{0,500}>\s{0,50}(\d{6})\s{0,50}</div>',
         
         # ==== 通用中英文规则 ====
         # 规则3: 匹配"验证码/Code"标签后的数字
@@ -64,11 +112,17 @@ class Config:
         # 规则4: 匹配独立一行中的4-8位数字
         r'^\s*(\d{4,8})\s*$',
         
-        # ==== 保底规则 (经过严格限制) ====
-        # 规则5: 独立的6位数字，但排除明显是颜色代码、尺寸等的数字
-        r'(?<![#\-\.\d])(\d{6})(?![#\-\.\d%px])',
+        # ==== 保底规则 (必须靠近关键词，避免订单号、时间戳等误报) ====
+        # 规则5: 关键词之后20个字符内的4-8位数字
+        r'(?:验证|校验|动态|code|verification|安全|security)[^\d\n]{0,20}(?<!\d)(\d{4,8})(?!\d)',
+        
+        # 规则6: 紧接在"验证码"之前的4-8位数字（如"123456是您的验证码"）
+        r'(?<!\d)(\d{4,8})(?!\d)[^\d\n]{0,10}(?:验证码|verification code)',
     ]
     
+    # 验证码关键词（小写），除规则4外每条规则都至少包含其中之一
+    CODE_KEYWORDS = ('验证', '校验', '动态', 'code', 'verification', '安全', 'security')
+    
     @classmethod
     def get_env(cls, key: str, default: str = "") -> str:
         """获取环境变量"""
@@ -96,6 +150,43 @@ class Config:
         
         return True
 
+# 预编译验证码模式（进程内只编译一次）
+# 前两条为高精度规则（作用于原始HTML），其余为通用规则（作用于清理后文本）
+# 按优先级逐条搜索：各模式可利用字面前缀快速定位，比合并成一个交替模式更快
+_CODE_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in Config.CODE_PATTERNS)
+_HIGH_PRECISION_PATTERNS = _CODE_PATTERNS[:2]
+_GENERIC_PATTERNS = _CODE_PATTERNS[2:]
+
+# HTML 清理用的模式
+# 第一遍：HTML标签和数字实体（替换为空格后可能拼出新的卡号片段，须先行处理）
+_TAG_RE = re.compile(r'<[^>]+>|&#\d+;')
+# 第二遍：颜色代码、CSS属性、带分隔符的卡号数字串合并为一次扫描（按原有顺序排列）
+_NOISE_RE = re.compile(
+    r'#\d{3,6}'                                            # #333, #333333 等颜色代码
+    r'|rgba?\(\s*\d+\s*,\s*\d+\s*,\s*\d+'                  # rgb(), rgba()
+    r'|\b(?:margin|padding|width|height|color|font-size)[: ]*\d+'  # 常见CSS属性
+    r'|\d+px'
+    r'|\b\d{4}(?:[- ]\d{4}){1,3}\b',                          # 完整/部分/短格式卡号
+    re.IGNORECASE
+)
+_WS_RE = re.compile(r'\s+')
+_DIGIT_RE = re.compile(r'\d')
+
+# 银行卡号模式（按优先级排序）
+_CARD_PATTERNS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    # 1. 掩码分隔格式：XXXX-XXxx-xxxx-XXXX (如：4931-93xx-xxxx-6206)
+    r'\b\d{4}[- ][\dXx]{2,4}[- ][\dXx]{2,4}[- ](\d{4})\b',
+    
+    # 2. 连续掩码格式：XXXXXXXXxxxxxxXXXX (如：49387519xxxxxx5392)
+    r'\b\d{8,12}[Xx]{4,8}(\d{4})\b',
+    
+    # 3. 通用分隔格式：XXXX XXXX XXXX XXXX
+    r'\b\d{4}[- ]\d{4}[- ]\d{4}[- ](\d{4})\b',
+    
+    # 4. 简单尾号提示："尾号XXXX"或"后四位XXXX"
+    r'(?:尾号|后四位|末四位)[:：\s]*(\d{4})',
+))
+
 # ==================== 日志配置 ====================
 class ColoredFormatter(logging.Formatter):
     """彩色日志格式化器"""
@@ -138,8 +229,9 @@ def setup_logging():
         file_handler.setFormatter(file_formatter)
         logger.addHandler(file_handler)
     
-    # 控制台格式化
-    console_formatter = ColoredFormatter(
+    # 控制台格式化（输出不是终端时，如容器日志，颜色转义码无意义，使用普通格式）
+    formatter_class = ColoredFormatter if console_handler.stream.isatty() else logging.Formatter
+    console_formatter = formatter_class(
         '[%(asctime)s] %(levelname)s - %(message)s',
         datefmt='%H:%M:%S'
     )
@@ -160,6 +252,10 @@ class EmailInfo:
     code: Optional[str] = None
     raw_body: str = ""
     card_last_four: Optional[str] = None  # 银行卡后4位
+    message_id: str = ""
+
+# 北京时间字符串缓存 [epoch 秒, 格式化结果]，最多滞后 1 秒
+_time_cache: list = [0, ""]
 
 @dataclass
 class HealthMetrics:
@@ -171,22 +267,38 @@ class HealthMetrics:
     errors: int = 0
     last_email_check: Optional[float] = None
     last_telegram_send: Optional[float] = None
+    # 监控线程、发送线程和健康检查线程同时读写计数器
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    
+    def incr(self, name: str, amount: int = 1):
+        """原子地累加计数器"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
     
     def to_dict(self) -> Dict:
         """转换为字典"""
         uptime = int(time.time() - self.start_time)
         
+        # 在锁内取一致的快照，避免读到更新了一半的指标
+        with self._lock:
+            email_checks = self.email_checks
+            emails_forwarded = self.emails_forwarded
+            telegram_sent = self.telegram_sent
+            errors = self.errors
+            last_email_check = self.last_email_check
+            last_telegram_send = self.last_telegram_send
+        
         return {
             "status": "healthy",
             "service": "qq_email_monitor",
             "uptime_seconds": uptime,
             "uptime_human": str(timedelta(seconds=uptime)),
-            "email_checks": self.email_checks,
-            "emails_forwarded": self.emails_forwarded,
-            "telegram_sent": self.telegram_sent,
-            "error_count": self.errors,
-            "last_email_check": self.format_time(self.last_email_check),
-            "last_telegram_send": self.format_time(self.last_telegram_send),
+            "email_checks": email_checks,
+            "emails_forwarded": emails_forwarded,
+            "telegram_sent": telegram_sent,
+            "error_count": errors,
+            "last_email_check": self.format_time(last_email_check),
+            "last_telegram_send": self.format_time(last_telegram_send),
             "current_time": self.get_beijing_time(),
             "version": "1.4.1"
         }
@@ -201,9 +313,43 @@ class HealthMetrics:
     
     @staticmethod
     def get_beijing_time() -> str:
-        """获取北京时间"""
-        now = datetime.now(Config.BEIJING_TZ)
-        return now.strftime('%Y-%m-%d %H:%M:%S')
+        """获取北京时间（按秒缓存格式化结果，同一秒内的健康检查请求直接复用）"""
+        now = int(time.time())
+        if now != _time_cache[0]:
+            # 先算字符串再整体替换，无锁并发读到的也总是配对的一组值
+            _time_cache[:] = [now, datetime.fromtimestamp(now, Config.BEIJING_TZ).strftime('%Y-%m-%d %H:%M:%S')]
+        return _time_cache[1]
+
+# ==================== 停止信号 ====================
+# 请求停止后置位，各线程在检查点调用 stop_requested() 后退出
+shutdown_event = threading.Event()
+# 停止时写入一个字节，唤醒阻塞在 select 上的等待（从不读取，此后始终可读）
+_wakeup_recv, _wakeup_send = socket.socketpair()
+_wakeup_send.setblocking(False)
+# 信号处理函数只设置此标志：Event.set() 需要获取内部锁，
+# 若信号恰好打断持有该锁的 Event.wait()，在信号处理函数中调用会死锁
+_stop_signalled = False
+
+def request_shutdown(signum: int = 0, frame=None):
+    """信号处理函数：只设置标志并写入唤醒字节（不获取任何锁）"""
+    global _stop_signalled
+    _stop_signalled = True
+    try:
+        _wakeup_send.send(b"\0")
+    except OSError:
+        pass
+
+def stop_requested() -> bool:
+    """是否已请求停止；在普通代码中把信号标志同步到 shutdown_event"""
+    if _stop_signalled and not shutdown_event.is_set():
+        shutdown_event.set()
+    return shutdown_event.is_set()
+
+def wait_for_shutdown(timeout: float) -> bool:
+    """代替 time.sleep：最多等待 timeout 秒，收到停止信号时立即返回 True"""
+    if not stop_requested():
+        select.select([_wakeup_recv], [], [], max(0.0, timeout))
+    return stop_requested()
 
 # ==================== 健康检查服务器 ====================
 class EnhancedHealthHandler(BaseHTTPRequestHandler):
@@ -212,12 +358,32 @@ class EnhancedHealthHandler(BaseHTTPRequestHandler):
     server_version = "EmailMonitor/1.4"
     metrics = HealthMetrics(start_time=time.time())
     
+    # 固定的响应头，只构建一次
+    JSON_HEADERS = (
+        ('Content-type', 'application/json; charset=utf-8'),
+        ('Cache-Control', 'no-store, no-cache, must-revalidate'),
+        ('Pragma', 'no-cache'),
+        ('Expires', '0'),
+    )
+    
+    # 按秒缓存的 JSON 响应体 [epoch 秒, 编码后的 bytes]，同一秒内的探活请求直接复用
+    _body_cache: list = [0, b""]
+    
+    def _send_json_headers(self, content_length: Optional[int] = None):
+        """发送 200 状态行和固定响应头（由 end_headers 一次性写出）"""
+        self.send_response(200)
+        for key, value in self.JSON_HEADERS:
+            self.send_header(key, value)
+        if content_length is not None:
+            self.send_header('Content-Length', str(content_length))
+        self.end_headers()
+    
     def log_message(self, format: str, *args):
         """自定义日志格式"""
         client_ip = self.client_address[0]
         request_line = args[0] if args else ""
         
-        # 忽略自我唤醒的日志
+        # 忽略本机探活（如容器健康检查）的日志
         if client_ip in ["127.0.0.1", "::1"] and "HEAD" in request_line:
             return
         
@@ -227,24 +393,19 @@ class EnhancedHealthHandler(BaseHTTPRequestHandler):
         """处理GET请求"""
         self.metrics.last_email_check = time.time()
         
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        self.send_header('Pragma', 'no-cache')
-        self.send_header('Expires', '0')
-        self.end_headers()
-        
-        response = self.metrics.to_dict()
-        self.wfile.write(json.dumps(response, indent=2, ensure_ascii=False).encode('utf-8'))
+        now = int(time.time())
+        if now != self._body_cache[0]:
+            # 紧凑格式编码，先算出长度以便客户端无需等待连接关闭
+            body = json.dumps(self.metrics.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self._body_cache[:] = [now, body]
+        body = self._body_cache[1]
+        self._send_json_headers(len(body))
+        self.wfile.write(body)
     
     def do_HEAD(self):
-        """处理HEAD请求（UptimeRobot等监控服务使用）"""
+        """处理HEAD请求（UptimeRobot等监控服务使用），不生成响应体"""
         self.metrics.last_email_check = time.time()
-        
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        self.end_headers()
+        self._send_json_headers()
     
     def do_POST(self):
         """处理POST请求（可用于手动触发检查）"""
@@ -268,79 +429,213 @@ def run_health_server():
     server_address = (Config.HEALTH_HOST, Config.HEALTH_PORT)
     
     try:
-        httpd = HTTPServer(server_address, EnhancedHealthHandler)
+        # 多线程处理：多个探活请求同时到达时不必排队
+        httpd = ThreadingHTTPServer(server_address, EnhancedHealthHandler)
         logger.info(f"🛡️  健康服务器启动 | 地址: http://{Config.HEALTH_HOST}:{Config.HEALTH_PORT}")
-        httpd.serve_forever()
     except Exception as e:
         logger.error(f"❌ 健康服务器启动失败: {e}")
         sys.exit(1)
-
-# ==================== 自我唤醒系统 ====================
-class SelfWaker:
-    """自我唤醒系统"""
     
-    def __init__(self, service_url: str = None):
-        self.service_url = service_url or f"http://localhost:{Config.HEALTH_PORT}"
-        self.interval = Config.SELF_PING_INTERVAL
+    # 每 0.5 秒检查一次停止信号，退出时关闭监听套接字
+    httpd.timeout = 0.5
+    with httpd:
+        while not stop_requested():
+            httpd.handle_request()
+
+# ==================== IMAP 响应解析 ====================
+_IMAP_TOKEN_RE = re.compile(
+    rb'\{(\d+)\}$'                                 # 字面量长度标记 {n}
+    rb'|(\()|(\))'                                 # 括号
+    rb'|"((?:[^"\\]|\\.)*)"'                         # 引号字符串
+    rb'|([^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?)'   # 原子，可带 [节号]<偏移>
+)
+
+def _parse_imap_response(data: List) -> List:
+    """将 imaplib 返回的 FETCH 数据解析为嵌套列表（NIL 为 None，其余为 bytes）"""
+    root: List = []
+    stack = [root]
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            text, literal = item[0], item[1]
+        else:
+            text, literal = item, None
         
-        # 从环境变量读取间隔
-        env_interval = Config.get_env("SELF_PING_INTERVAL")
-        if env_interval and env_interval.isdigit():
-            self.interval = int(env_interval)
-            logger.info(f"🔧 使用自定义唤醒间隔: {self.interval}秒")
-    
-    def ping(self) -> bool:
-        """执行自我唤醒"""
-        try:
-            # 添加随机抖动避免固定间隔
-            jitter = random.randint(-5, 5)
-            time.sleep(max(0, jitter))
-            
-            response = requests.head(
-                self.service_url,
-                timeout=10,
-                headers={'User-Agent': 'SelfWaker/1.0'}
-            )
-            
-            if response.status_code == 200:
-                logger.debug(f"🔄 自我唤醒成功")
-                return True
+        for match in _IMAP_TOKEN_RE.finditer(text):
+            size, opening, closing, quoted, atom = match.groups()
+            if size is not None:
+                stack[-1].append(literal if literal is not None else b"")
+            elif opening:
+                stack.append([])
+                stack[-2].append(stack[-1])
+            elif closing:
+                if len(stack) > 1:
+                    stack.pop()
+            elif quoted is not None:
+                stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted))
+            elif atom.upper() == b"NIL":
+                stack[-1].append(None)
             else:
-                logger.warning(f"⚠️ 唤醒响应异常: {response.status_code}")
-                return False
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"❌ 自我唤醒失败: {e}")
-            return False
+                stack[-1].append(atom)
+    return root
+
+def _parse_fetch(data: List, by_uid: bool = False) -> Dict[bytes, Dict[bytes, object]]:
+    """解析 FETCH 响应，返回 {序号或UID: {数据项名(大写): 值}}"""
+    tokens = _parse_imap_response(data)
+    result: Dict[bytes, Dict[bytes, object]] = {}
+    for seq, items in zip(tokens[::2], tokens[1::2]):
+        if not isinstance(seq, bytes) or not isinstance(items, list):
+            continue
+        entry = result.setdefault(seq, {})
+        for key, value in zip(items[::2], items[1::2]):
+            if isinstance(key, bytes):
+                entry[key.upper()] = value
     
-    def run(self):
-        """运行唤醒循环"""
-        logger.info(f"🚀 自我唤醒系统启动 | 间隔: {self.interval}秒")
-        
-        cycle = 0
-        consecutive_failures = 0
-        
-        while True:
+    if by_uid:
+        return {items[b"UID"]: items for items in result.values() if isinstance(items.get(b"UID"), bytes)}
+    return result
+
+def _fetch_item(items: Dict[bytes, object], prefix: bytes) -> Optional[object]:
+    """按前缀取 FETCH 数据项（服务器回显的节名格式可能略有差异）"""
+    for key, value in items.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+def _find_text_part(structure: List, prefix: str = "", subtype: str = "plain") -> Optional[Tuple[str, str, str]]:
+    """在 BODYSTRUCTURE 中查找第一个非附件的 text/<subtype> 部分
+    
+    返回 (节号, 传输编码, 字符集)；非 multipart 邮件直接使用整个正文
+    """
+    if not structure:
+        return None
+    
+    # multipart: (子部分1 子部分2 ... 子类型 ...)
+    if isinstance(structure[0], list):
+        for index, child in enumerate(structure, 1):
+            if not isinstance(child, list):
+                break
+            found = _find_text_part(child, f"{prefix}{index}.", subtype)
+            if found:
+                return found
+        return None
+    
+    def _str_at(index: int) -> str:
+        value = structure[index] if len(structure) > index else None
+        return value.decode("ascii", errors="ignore").lower() if isinstance(value, bytes) else ""
+    
+    params = structure[2] if len(structure) > 2 and isinstance(structure[2], list) else []
+    charset = ""
+    for key, value in zip(params[::2], params[1::2]):
+        if isinstance(key, bytes) and key.lower() == b"charset" and isinstance(value, bytes):
+            charset = value.decode("ascii", errors="ignore")
+    encoding = _str_at(5)
+    
+    # 单部分邮件：与 multipart 无关，整体作为正文
+    if not prefix:
+        return "TEXT", encoding, charset
+    
+    if _str_at(0) != "text" or _str_at(1) != subtype:
+        return None
+    
+    # 文本部分的扩展字段中 disposition 位于第 10 项
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and isinstance(disposition[0], bytes) \
+            and disposition[0].lower() == b"attachment":
+        return None
+    
+    return prefix.rstrip("."), encoding, charset
+
+_HEADER_PARSER = BytesHeaderParser()
+
+def _join_header_parts(decoded_parts: List[Tuple[object, Optional[str]]]) -> str:
+    """逐段宽松解码 decode_header 的结果，未知字符集按 UTF-8 解码，尽量保留可读内容"""
+    result_parts = []
+    for content, charset in decoded_parts:
+        if isinstance(content, bytes):
             try:
-                cycle += 1
-                time.sleep(self.interval)
-                
-                success = self.ping()
-                
-                if success:
-                    consecutive_failures = 0
-                    if cycle % 12 == 0:  # 每小时报告一次
-                        logger.info(f"✅ 自我唤醒运行正常 | 已执行 {cycle} 次")
+                result_parts.append(content.decode(charset or 'utf-8', errors='ignore'))
+            except LookupError:
+                result_parts.append(content.decode('utf-8', errors='ignore'))
+        else:
+            result_parts.append(content)
+    return ''.join(result_parts).strip()
+
+@lru_cache(maxsize=256)
+def _decode_mime_header(header: str) -> str:
+    """解码 RFC 2047 编码的邮件头（同一模板的标题反复出现时直接命中缓存）"""
+    # 不含 RFC 2047 编码字的邮件头（常见的纯ASCII标题）无需解码
+    if "=?" not in header:
+        return header.strip()
+    
+    try:
+        decoded_parts = decode_header(header)
+    except (MessageError, ValueError, TypeError):
+        return str(header)
+    
+    try:
+        # make_header 一次完成各段的字符集解码和拼接
+        return str(make_header(decoded_parts)).strip()
+    except (LookupError, UnicodeDecodeError, MessageError):
+        # 未知字符集或编码不规范
+        return _join_header_parts(decoded_parts)
+
+@lru_cache(maxsize=256)
+def _format_mail_date(date_str: str) -> str:
+    """将邮件 Date 头转换为北京时间 HH:MM:SS（同一封邮件重复处理时直接命中缓存）"""
+    try:
+        date_obj = parsedate_to_datetime(date_str)
+        # "-0000" 时区解析为无时区时间，按 RFC 5322 视为 UTC，而不是本机时区
+        if date_obj.tzinfo is None:
+            date_obj = date_obj.replace(tzinfo=timezone.utc)
+        # 换算时区可能越过 datetime 的年份上限（如 9999-12-31 -0500）
+        return date_obj.astimezone(Config.BEIJING_TZ).strftime('%H:%M:%S')
+    except (TypeError, ValueError, OverflowError, AttributeError):
+        return "时间解析失败"
+
+def _decode_transfer(payload: bytes, encoding: str) -> bytes:
+    """按 Content-Transfer-Encoding 解码正文"""
+    if encoding == "base64":
+        # 部分获取时末尾可能不足一组，截断到4的整数倍
+        data = b"".join(payload.split())
+        return base64.b64decode(data[:len(data) - len(data) % 4])
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
+
+# ==================== 发送限流 ====================
+class TokenBucket:
+    """令牌桶限流器（线程安全），令牌不足时 acquire 阻塞等待"""
+    
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate  # 每秒补充的令牌数
+        self.tokens = capacity
+        self.updated = time.monotonic()  # 可能被 defer 推到将来，此前不补充令牌
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """取得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.updated:
+                    wait = self.updated - now
                 else:
-                    consecutive_failures += 1
-                    if consecutive_failures >= 3:
-                        logger.error(f"🚨 连续唤醒失败 {consecutive_failures} 次")
-                
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                logger.error(f"唤醒循环异常: {e}")
-                time.sleep(60)
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def defer(self, seconds: float):
+        """暂停发放 seconds 秒，之后只有一个令牌可用（服务器返回 retry_after 时使用）"""
+        with self._lock:
+            self.tokens = min(self.capacity, 1)
+            self.updated = max(self.updated, time.monotonic() + seconds)
 
 # ==================== 邮箱监控核心 ====================
 class EmailMonitor:
@@ -353,7 +648,44 @@ class EmailMonitor:
         self.chat_ids = [cid.strip() for cid in Config.get_env("CHAT_ID").split(",") if cid.strip()]
         
         self.error_count = 0
+        
+        # Telegram 长连接会话：复用 TLS 连接，网络错误和 5xx 自动重试
+        # （429 限流由发送逻辑根据 retry_after 处理）
         self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=8,  # 与并行发送线程数上限一致
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504],
+                allowed_methods=frozenset(["POST"]),
+                raise_on_status=False
+            )
+        ))
+        self.send_url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        self._payload_template = {"parse_mode": "HTML", "disable_web_page_preview": True}
+        # 主动限流：每个会话约1条/秒，全局不超过30条/秒，避免触发 429
+        self._chat_buckets: Dict[str, TokenBucket] = {
+            cid: TokenBucket(1, 1 / Config.TELEGRAM_SEND_INTERVAL) for cid in self.chat_ids
+        }
+        self._global_bucket = TokenBucket(Config.TELEGRAM_GLOBAL_BURST, Config.TELEGRAM_GLOBAL_RATE)
+        # 单线程发送队列：与 IMAP 操作并行，且保证消息按顺序发出、限流状态无需加锁
+        self._send_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telegram")
+        # 多接收者并行发送（每个会话由一个线程负责，各自的限流状态互不干扰）
+        self._fanout_pool = ThreadPoolExecutor(
+            max_workers=max(1, min(8, len(self.chat_ids))), thread_name_prefix="telegram-chat"
+        )
+        self._imap: Optional[imaplib.IMAP4_SSL] = None  # 长连接（IDLE 需要）
+        self._imap_connected_at = 0.0  # 建立连接的时间（monotonic）
+        self._imap_verified_at = 0.0   # 最近一次确认连接可用的时间（monotonic）
+        self._modseq: Optional[int] = None         # CONDSTORE 增量搜索基线，None 表示需全量搜索
+        self._forwarded: "OrderedDict[str, float]" = OrderedDict()  # 最近转发的邮件 -> 转发时间
+        self._last_clean: Tuple[str, str] = ("", "")  # 最近一次 HTML 清理的 (原文, 结果)
+        self._uidvalidity: Optional[bytes] = None  # INBOX 的 UIDVALIDITY，变化后 UID 不再可比
+        self._handled_uids: "OrderedDict[bytes, None]" = OrderedDict()  # 已处理过的 UID
+        self._last_uid = 0  # 已全部处理完的最大 UID（高水位），之后只搜索更大的 UID
+        self._select_modseq: Optional[int] = None  # SELECT 时服务器报告的 HIGHESTMODSEQ
         
         logger.info("=" * 60)
         logger.info(f"📧 监控邮箱: {self.email}")
@@ -361,57 +693,37 @@ class EmailMonitor:
         logger.info(f"⏰ 启动时间: {HealthMetrics.get_beijing_time()}")
         logger.info("=" * 60)
     
-    def decode_header(self, header: str) -> str:
+    def decode_header(self, header: Union[str, Header]) -> str:
         """解码邮件头"""
         if not header:
             return "无标题"
-        
-        try:
-            decoded_parts = decode_header(header)
-            result_parts = []
-            
-            for content, charset in decoded_parts:
-                if isinstance(content, bytes):
-                    try:
-                        charset = charset or 'utf-8'
-                        result_parts.append(content.decode(charset, errors='ignore'))
-                    except (LookupError, UnicodeDecodeError):
-                        result_parts.append(content.decode('utf-8', errors='ignore'))
-                else:
-                    result_parts.append(str(content))
-            
-            return ''.join(result_parts).strip()
-        except Exception:
-            return str(header)
+        if isinstance(header, str):
+            return _decode_mime_header(header)
+        # 含 8 位字节的原始标题（如未编码的 UTF-8）解析为 Header 对象：不可哈希，
+        # 且 str() 会把字节替换为 U+FFFD，因此不走缓存，直接逐段宽松解码
+        return _join_header_parts(decode_header(header))
     
     def _clean_html_text(self, text: str) -> str:
-        """清理HTML标签和样式，防止误匹配"""
+        """清理HTML标签和样式，防止误匹配
+        
+        验证码和银行卡提取会先后清理同一段正文，缓存最近一次结果避免重复清理
+        """
         if not text:
             return ""
+        if self._last_clean[0] == text:
+            return self._last_clean[1]
         
-        # 移除HTML标签
-        cleaned = re.sub(r'<[^>]+>', ' ', text)
-        
-        # 专门移除颜色代码
-        cleaned = re.sub(r'#\d{3,6}', ' ', cleaned)  # 移除 #333, #333333 等颜色代码
-        cleaned = re.sub(r'rgba?\(\s*\d+\s*,\s*\d+\s*,\s*\d+', ' ', cleaned)  # 移除 rgb(), rgba()
+        # 移除HTML标签和数字实体（纯文本正文中两者都不存在，直接跳过这一遍扫描）
+        cleaned = _TAG_RE.sub(' ', text) if '<' in text or '&#' in text else text
         
-        # 移除常见CSS属性
-        cleaned = re.sub(r'\b(margin|padding|width|height|color|font-size)[: ]*\d+', ' ', cleaned, flags=re.IGNORECASE)
-        cleaned = re.sub(r'\d+px', ' ', cleaned, flags=re.IGNORECASE)
-        
-        # 移除HTML数字实体
-        cleaned = re.sub(r'&#\d+;', ' ', cleaned)
-        
-        # 移除银行卡号等常见带分隔符的数字串
-        cleaned = re.sub(r'\b\d{4}[- ]\d{4}[- ]\d{4}[- ]\d{4}\b', ' ', cleaned)  # 完整卡号
-        cleaned = re.sub(r'\b\d{4}[- ]\d{4}[- ]\d{4}\b', ' ', cleaned)           # 部分卡号
-        cleaned = re.sub(r'\b\d{4}[- ]\d{4}\b', ' ', cleaned)                    # 短格式卡号片段
+        # 移除颜色代码、CSS属性和银行卡号等带分隔符的数字串
+        cleaned = _NOISE_RE.sub(' ', cleaned)
         
         # 合并多余空格
-        cleaned = re.sub(r'\s+', ' ', cleaned)
+        cleaned = _WS_RE.sub(' ', cleaned).strip()
         
-        return cleaned.strip()
+        self._last_clean = (text, cleaned)
+        return cleaned
     
     def extract_verification_code(self, text: str) -> Optional[str]:
         """提取验证码"""
@@ -419,30 +731,49 @@ class EmailMonitor:
             return None
         
         # 截取足够长的字符以确保包含验证码
-        search_text = text[:2000]
+        limit = Config.CODE_SEARCH_CHARS
+        head = text[:limit]
         
-        logger.debug(f"【DEBUG】原始文本 (前200字符): {repr(search_text[:200])}")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("【DEBUG】原始文本 (前200字符): %r", text[:200])
         
-        # 对文本进行清理
-        cleaned_text = self._clean_html_text(search_text)
-        logger.debug(f"【DEBUG】清理后的文本: {repr(cleaned_text[:200])}")
+        # 不含任何数字的邮件不可能有验证码，跳过清理和全部规则
+        if not _DIGIT_RE.search(head):
+            return None
         
-        # 首先在原始HTML中尝试高精度匹配
-        for pattern in Config.CODE_PATTERNS[:2]:  # 只使用前两个高精度规则
-            match = re.search(pattern, search_text, re.IGNORECASE)
-            if match:
-                code = match.group(1)
-                if code.isdigit() and 4 <= len(code) <= 8:
-                    logger.debug(f"【DEBUG】高精度匹配命中: 模式 '{pattern}' -> 提取内容 '{code}'")
-                    return code
+        # 关键词预筛：大部分邮件（通知、广告）不含任何关键词，直接跳过正则匹配
+        lowered = head.lower()
+        if not any(kw in lowered for kw in Config.CODE_KEYWORDS):
+            # 此时只有规则4（全文仅为4-8位数字）可能命中
+            candidate = self._clean_html_text(head)
+            if candidate.isdigit() and 4 <= len(candidate) <= 8:
+                return candidate
+            return None
+        
+        # 首先在原始HTML中尝试高精度匹配（使用 endpos 避免切片复制）
+        # 高精度规则都以"验证码"开头，先用 str.find 快速排除
+        if text.find("验证码", 0, limit) != -1:
+            for rank, pattern in enumerate(_HIGH_PRECISION_PATTERNS):
+                match = pattern.search(text, 0, limit)
+                if match:
+                    code = match.group(1)
+                    if code.isdigit() and 4 <= len(code) <= 8:
+                        logger.debug("【DEBUG】高精度匹配命中: 规则%d -> 提取内容 '%s'", rank + 1, code)
+                        return code
+        
+        # 对文本进行清理
+        cleaned_text = self._clean_html_text(head)
+        if debug:
+            logger.debug("【DEBUG】清理后的文本: %r", cleaned_text[:200])
         
         # 如果在原始HTML中没匹配到，尝试在清理后的文本中匹配通用规则
-        for pattern in Config.CODE_PATTERNS[2:]:  # 使用剩余的通用规则
-            match = re.search(pattern, cleaned_text, re.IGNORECASE)
+        for rank, pattern in enumerate(_GENERIC_PATTERNS):
+            match = pattern.search(cleaned_text)
             if match:
                 code = match.group(1)
                 if code.isdigit() and 4 <= len(code) <= 8:
-                    logger.debug(f"【DEBUG】通用规则匹配命中: 模式 '{pattern}' -> 提取内容 '{code}'")
+                    logger.debug("【DEBUG】通用规则匹配命中: 规则%d -> 提取内容 '%s'", rank + 3, code)
                     return code
         
         return None
@@ -452,34 +783,19 @@ class EmailMonitor:
         if not text:
             return None
         
-        # 银行卡号模式（按优先级排序）
-        patterns = [
-            # 1. 掩码分隔格式：XXXX-XXxx-xxxx-XXXX (如：4931-93xx-xxxx-6206)
-            r'\b\d{4}[- ][\dXx]{2,4}[- ][\dXx]{2,4}[- ](\d{4})\b',
-            
-            # 2. 连续掩码格式：XXXXXXXXxxxxxxXXXX (如：49387519xxxxxx5392)
-            r'\b\d{8,12}[Xx]{4,8}(\d{4})\b',
-            
-            # 3. 通用分隔格式：XXXX XXXX XXXX XXXX
-            r'\b\d{4}[- ]\d{4}[- ]\d{4}[- ](\d{4})\b',
-            
-            # 4. 简单尾号提示："尾号XXXX"或"后四位XXXX"
-            r'(?:尾号|后四位|末四位)[:：\s]*(\d{4})',
-        ]
-        
         # 策略1：首先在整个文本中搜索（提高成功率）
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern in _CARD_PATTERNS:
+            match = pattern.search(text)
             if match and match.group(1):
-                logger.debug(f"🔍 银行卡匹配命中(全文本): 模式 '{pattern}' -> 提取 '{match.group(1)}'")
+                logger.debug("🔍 银行卡匹配命中(全文本): 模式 '%s' -> 提取 '%s'", pattern.pattern, match.group(1))
                 return match.group(1)
         
         # 策略2：如果没找到，尝试清理HTML后查找
-        cleaned_text = self._clean_html_text(text[:1000])
-        for pattern in patterns:
-            match = re.search(pattern, cleaned_text, re.IGNORECASE)
+        cleaned_text = self._clean_html_text(text[:Config.CODE_SEARCH_CHARS])
+        for pattern in _CARD_PATTERNS:
+            match = pattern.search(cleaned_text)
             if match and match.group(1):
-                logger.debug(f"🔍 银行卡匹配命中(清理后): 模式 '{pattern}' -> 提取 '{match.group(1)}'")
+                logger.debug("🔍 银行卡匹配命中(清理后): 模式 '%s' -> 提取 '%s'", pattern.pattern, match.group(1))
                 return match.group(1)
         
         return None
@@ -499,9 +815,32 @@ class EmailMonitor:
                 imap = imaplib.IMAP4(Config.IMAP_SERVER, Config.IMAP_PORT)
                 imap.starttls()
             
+            self._enable_keepalive(imap.sock)
             imap.login(self.email, self.password)
+            
+            # 登录后服务器能力可能变化（如 IDLE），刷新能力列表
+            status, data = imap.capability()
+            if status == "OK" and data and data[-1]:
+                imap.capabilities = tuple(data[-1].decode("ascii", errors="ignore").upper().split())
+            
             imap.select("INBOX")
             
+            # UIDVALIDITY 变化意味着 UID 被重新分配，已处理 UID 记录随之作废
+            _, data = imap.response("UIDVALIDITY")
+            uidvalidity = data[0] if data and data[0] else None
+            if uidvalidity != self._uidvalidity:
+                self._handled_uids.clear()
+                self._uidvalidity = uidvalidity
+                self._last_uid = self._load_last_uid(uidvalidity)
+            
+            # 新连接先全量搜索一次，之后以 SELECT 时的 HIGHESTMODSEQ 为基线增量搜索
+            self._modseq = None
+            self._select_modseq = None
+            if "CONDSTORE" in imap.capabilities:
+                _, data = imap.response("HIGHESTMODSEQ")
+                if data and data[0] and data[0].isdigit():
+                    self._select_modseq = int(data[0])
+            
             logger.debug("✅ IMAP连接成功")
             return imap
             
@@ -514,54 +853,285 @@ class EmailMonitor:
         
         return None
     
-    def process_email(self, imap: imaplib.IMAP4_SSL, email_id: bytes) -> Optional[EmailInfo]:
-        """处理单封邮件"""
+    @staticmethod
+    def _enable_keepalive(sock: socket.socket):
+        """开启 TCP 保活，长时间 IDLE 时也能及时发现已失效的连接"""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # 以下选项并非所有平台都支持
+        for name, value in (
+            ("TCP_KEEPIDLE", Config.TCP_KEEPIDLE),
+            ("TCP_KEEPINTVL", Config.TCP_KEEPINTVL),
+            ("TCP_KEEPCNT", Config.TCP_KEEPCNT),
+        ):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+    
+    def get_imap(self) -> Optional[imaplib.IMAP4_SSL]:
+        """获取IMAP长连接，断开或到期时自动重连"""
+        now = time.monotonic()
+        
+        if self._imap is not None:
+            if now - self._imap_connected_at >= Config.IMAP_RECYCLE_INTERVAL:
+                logger.debug("♻️ IMAP连接已使用较久，主动重建")
+                self.close_imap()
+            elif now - self._imap_verified_at >= Config.CHECK_INTERVAL:
+                # 长时间未通信，用 NOOP 确认连接仍然可用
+                try:
+                    status, _ = self._imap.noop()
+                    if status != "OK":
+                        raise imaplib.IMAP4.abort(f"NOOP 返回 {status}")
+                    self._imap_verified_at = now
+                except (imaplib.IMAP4.error, OSError) as e:
+                    logger.warning(f"⚠️ IMAP连接已失效，重新连接: {e}")
+                    self.close_imap()
+        
+        if self._imap is None:
+            self._imap = self.connect_imap()
+            self._imap_connected_at = self._imap_verified_at = time.monotonic()
+        return self._imap
+    
+    def close_imap(self):
+        """关闭并丢弃当前IMAP连接，下次使用时重连"""
+        imap, self._imap = self._imap, None
+        if imap is None:
+            return
+        try:
+            imap.logout()
+        except Exception:
+            pass
+    
+    @staticmethod
+    def _has_buffered_data(imap: imaplib.IMAP4_SSL) -> bool:
+        """是否已有未处理的数据（select 看不到这些数据）
+        
+        包括 SSL 层已解密的记录，以及 imaplib 读缓冲(imap.file)中 readline 之后剩下的行
+        """
+        pending = getattr(imap.sock, "pending", None)
+        if pending and pending():
+            return True
+        
+        # 缓冲区非空时 peek 直接返回其内容；为空时会读套接字，临时切到非阻塞避免等待
+        sock_timeout = imap.sock.gettimeout()
+        imap.sock.setblocking(False)
+        try:
+            return bool(imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            imap.sock.settimeout(sock_timeout)
+    
+    def idle(self, imap: imaplib.IMAP4_SSL, timeout: float) -> bool:
+        """进入 IDLE 等待服务器推送，收到新邮件(EXISTS)时返回 True"""
+        tag = imap._new_tag()
+        imap.tagged_commands.pop(tag, None)
+        imap.send(tag + b" IDLE\r\n")
+        
+        # 服务器可能在继续请求(+)之前先发送未经请求的响应（如 EXISTS、EXPUNGE）
+        has_new = False
+        while True:
+            line = imap.readline()
+            if line.startswith(b"+"):
+                break
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(f"服务器断开连接: {line!r}")
+            if not line.startswith(b"*"):
+                raise imaplib.IMAP4.error(f"IDLE 被拒绝: {line!r}")
+            has_new = has_new or b"EXISTS" in line.upper()
+        
+        try:
+            deadline = time.monotonic() + timeout
+            while not has_new:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                
+                # 已缓冲的数据不会触发 select，需先检查
+                if not self._has_buffered_data(imap):
+                    readable, _, _ = select.select([imap.sock, _wakeup_recv], [], [], remaining)
+                    if not readable or stop_requested():
+                        break
+                
+                line = imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("IDLE 期间连接被服务器关闭")
+                if line.startswith(b"* BYE"):
+                    raise imaplib.IMAP4.abort(f"服务器断开连接: {line!r}")
+                has_new = b"EXISTS" in line.upper()
+        finally:
+            # 结束 IDLE，读取直到本次命令的完成响应
+            imap.send(b"DONE\r\n")
+            while True:
+                line = imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("结束 IDLE 时连接被服务器关闭")
+                if line.startswith(tag):
+                    break
+                if b"EXISTS" in line.upper():
+                    has_new = True
+        
+        return has_new
+    
+    def wait_for_new_mail(self, elapsed: float = 0.0):
+        """等待下次检查：服务器支持 IDLE 时等待推送，否则按固定间隔轮询
+        
+        elapsed 为本轮检查已耗用的时间，轮询时从间隔中扣除以保持稳定节奏
+        """
+        imap = self._imap
+        if imap is None:
+            # 连接已断开：按连续失败次数指数退避后再重连，避免服务器故障时频繁重试
+            delay = min(Config.CHECK_INTERVAL * 2 ** self.error_count, Config.ERROR_BACKOFF)
+            wait_for_shutdown(delay - elapsed)
+            return
+        if "IDLE" not in imap.capabilities:
+            # 不支持 IDLE：等待到下个轮询点，期间服务器主动发来数据（如 EXISTS、BYE）时立即检查
+            remaining = max(0.0, Config.CHECK_INTERVAL - elapsed)
+            try:
+                if self._has_buffered_data(imap):
+                    return
+                readable, _, _ = select.select([imap.sock, _wakeup_recv], [], [], remaining)
+            except (OSError, ValueError):
+                wait_for_shutdown(remaining)
+                return
+            if imap.sock in readable:
+                logger.debug("📬 轮询等待期间收到服务器数据，提前检查")
+            return
+        
         try:
-            # 获取邮件
-            status, msg_data = imap.fetch(email_id, '(RFC822)')
+            if self.idle(imap, Config.IDLE_TIMEOUT):
+                logger.debug("📬 IDLE 收到新邮件推送")
+            self._imap_verified_at = time.monotonic()
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.warning(f"⚠️ IDLE 中断，将重新连接: {e}")
+            self.close_imap()
+    
+    def fetch_bodies(self, imap: imaplib.IMAP4_SSL, structures: Dict[bytes, object]) -> Dict[bytes, str]:
+        """根据 BODYSTRUCTURE 只获取正文文本部分，相同节号的邮件合并为一次 FETCH
+        
+        获取失败的邮件不在返回结果中（保持未读，下轮重试）；确实没有文本部分的邮件正文为空字符串
+        """
+        bodies: Dict[bytes, str] = {}
+        sections: Dict[str, List[bytes]] = {}
+        encodings: Dict[bytes, Tuple[str, str]] = {}
+        
+        for uid, structure in structures.items():
+            if not isinstance(structure, list):
+                # 无法解析结构时退回到获取整封邮件
+                body = self.fetch_full_body(imap, uid)
+                if body is not None:
+                    bodies[uid] = body
+                continue
+            
+            # 优先纯文本，没有时退回到 HTML 部分（高精度规则即针对 HTML 正文）
+            part = _find_text_part(structure) or _find_text_part(structure, subtype="html")
+            if part:
+                section, encoding, charset = part
+                encodings[uid] = (encoding, charset)
+                sections.setdefault(section, []).append(uid)
+            else:
+                bodies[uid] = ""
+        
+        for section, uids in sections.items():
+            status, msg_data = imap.uid(
+                'FETCH', b",".join(uids), f'(BODY.PEEK[{section}]<0.{Config.BODY_FETCH_BYTES}>)'
+            )
             if status != "OK":
-                return None
+                continue
+            
+            for uid, items in _parse_fetch(msg_data, by_uid=True).items():
+                # 没有 BODY[ 数据项视为获取失败；服务器回 NIL 表示该部分为空
+                if uid not in encodings or not any(key.startswith(b"BODY[") for key in items):
+                    continue
+                payload = _fetch_item(items, b"BODY[")
+                bodies[uid] = self._decode_body(payload, *encodings[uid]) if payload else ""
+        
+        return bodies
+    
+    def fetch_full_body(self, imap: imaplib.IMAP4_SSL, uid: bytes) -> Optional[str]:
+        """获取整封邮件并提取正文（BODYSTRUCTURE 不可用时的后备方案），获取失败时返回 None
+        
+        只获取前 FULL_FETCH_BYTES 字节：正文部分通常位于附件之前，截断的 MIME 仍可解析
+        """
+        status, msg_data = imap.uid('FETCH', uid, f'(BODY.PEEK[]<0.{Config.FULL_FETCH_BYTES}>)')
+        items = _parse_fetch(msg_data, by_uid=True).get(uid, {}) if status == "OK" else {}
+        raw = _fetch_item(items, b"BODY[")
+        if raw is None:
+            return None
+        # 与正常路径一致，正文长度不超过 BODY_FETCH_BYTES
+        return self._extract_body(email.message_from_bytes(raw, policy=policy.default))[:Config.BODY_FETCH_BYTES]
+    
+    @staticmethod
+    def _decode_body(payload: bytes, encoding: str, charset: str = "") -> str:
+        """按传输编码和字符集解码正文文本部分"""
+        try:
+            payload = _decode_transfer(payload, encoding)
+        except ValueError:
+            pass
+        try:
+            return payload.decode(charset or 'utf-8', errors='ignore')
+        except LookupError:
+            return payload.decode('utf-8', errors='ignore')
+    
+    def _extract_body(self, msg: email.message.EmailMessage) -> str:
+        """从完整解析的邮件中提取正文（优先 text/plain，没有时使用 text/html）
+        
+        get_body() 按优先级直接定位正文部分并跳过附件，无需 walk() 遍历整棵 MIME 树；
+        get_content() 已按传输编码和字符集解码
+        """
+        part = msg.get_body(preferencelist=('plain', 'html')) if msg.is_multipart() else msg
+        if part is None:
+            return ""
+        try:
+            content = part.get_content()
+        except (LookupError, ValueError, KeyError, MessageError):
+            payload = part.get_payload(decode=True)
+            return payload.decode('utf-8', errors='ignore') if isinstance(payload, bytes) else ""
+        return content if isinstance(content, str) else ""
+    
+    def fetch_emails(self, imap: imaplib.IMAP4_SSL, uids: List[bytes]) -> List[Tuple[bytes, EmailInfo]]:
+        """批量获取并解析邮件，返回 [(UID, 邮件信息)]，顺序与 uids 一致"""
+        # 一次取回所有邮件的邮件头和结构；使用 PEEK，已读标记由处理完成后统一设置
+        status, msg_data = imap.uid(
+            'FETCH', b",".join(uids), f'(BODY.PEEK[HEADER.FIELDS ({Config.HEADER_FIELDS})] BODYSTRUCTURE)'
+        )
+        if status != "OK":
+            return []
+        
+        fetched = _parse_fetch(msg_data, by_uid=True)
+        bodies = self.fetch_bodies(
+            imap, {uid: fetched[uid].get(b"BODYSTRUCTURE") for uid in uids if uid in fetched}
+        )
+        
+        results = []
+        for uid in uids:
+            header_bytes = _fetch_item(fetched.get(uid, {}), b"BODY[HEADER")
+            if header_bytes is None or uid not in bodies:
+                # 邮件头或正文获取失败：不加入结果，邮件保持未读，下轮重试
+                continue
             
-            # 解析邮件
-            msg = email.message_from_bytes(msg_data[0][1])
+            email_info = self.process_email(header_bytes, bodies[uid])
+            if email_info:
+                results.append((uid, email_info))
+        
+        return results
+    
+    def process_email(self, header_bytes: bytes, body: str) -> Optional[EmailInfo]:
+        """处理单封邮件（邮件头 + 正文文本）"""
+        try:
+            # 只解析邮件头
+            msg = _HEADER_PARSER.parsebytes(header_bytes)
             
             # 提取基本信息
             subject = self.decode_header(msg.get("Subject", ""))
             sender = msg.get("From", "")
-            date_str = msg.get("Date", "")
+            # 含 8 位字节的邮件头会解析为 Header 对象，转为 str 才能作为缓存键
+            date_str = str(msg.get("Date", ""))
+            message_id = str(msg.get("Message-ID", "")).strip()
             
             # 解析日期
-            try:
-                date_obj = parsedate_to_datetime(date_str)
-                date_beijing = date_obj.astimezone(Config.BEIJING_TZ)
-                date_formatted = date_beijing.strftime('%H:%M:%S')
-            except:
-                date_formatted = "时间解析失败"
-            
-            # 提取正文
-            body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    content_type = part.get_content_type()
-                    content_disposition = str(part.get("Content-Disposition", ""))
-                    
-                    if content_type == "text/plain" and "attachment" not in content_disposition:
-                        try:
-                            payload = part.get_payload(decode=True)
-                            if payload:
-                                body = payload.decode('utf-8', errors='ignore')
-                                break
-                        except:
-                            continue
-            else:
-                try:
-                    payload = msg.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode('utf-8', errors='ignore')
-                except:
-                    body = str(msg.get_payload())
+            date_formatted = _format_mail_date(date_str)
             
-            logger.debug(f"【DEBUG】解析到的邮件正文 (前500字符): {repr(body[:500])}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("【DEBUG】解析到的邮件正文 (前500字符): %r", body[:500])
             
             # 提取验证码
             code = self.extract_verification_code(body)
@@ -575,7 +1145,8 @@ class EmailMonitor:
                 date=date_formatted,
                 code=code,
                 raw_body=body[:500],
-                card_last_four=card_last_four
+                card_last_four=card_last_four,
+                message_id=message_id
             )
             
         except Exception as e:
@@ -587,52 +1158,37 @@ class EmailMonitor:
         try:
             current_time = datetime.now(Config.BEIJING_TZ).strftime('%H:%M:%S')
             
-            # 构建消息
+            # 构建消息（HTML 格式：标题经转义后任意字符都不会导致 Telegram 解析失败）
             message_lines = [
-                "📨 *验证码通知*",
+                "📨 <b>验证码通知</b>",
                 "──────────────",
-                f"*📌 标题*: {email_info.subject}",
+                f"<b>📌 标题</b>: {html.escape(email_info.subject)}",
                 "",
-                f"*🕒 时间*: {email_info.date} (7分钟内使用)",
+                f"<b>🕒 时间</b>: {html.escape(email_info.date)} (7分钟内使用)",
                 "",
             ]
             
             # 如果有银行卡后4位，则添加一行
             if email_info.card_last_four:
-                message_lines.append(f"*💳 卡号后四位*: `{email_info.card_last_four}`")
+                message_lines.append(f"<b>💳 卡号后四位</b>: <code>{email_info.card_last_four}</code>")
             
             # 继续原有格式
             message_lines.extend([
                 "",
-                f"*🔐 验证码*: `{email_info.code}`",
+                f"<b>🔐 验证码</b>: <code>{email_info.code}</code>",
                 "──────────────",
             ])
             
             message = "\n".join(message_lines)
             
-            success_count = 0
-            for chat_id in self.chat_ids:
-                try:
-                    url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-                    payload = {
-                        "chat_id": chat_id,
-                        "text": message,
-                        "parse_mode": "Markdown",
-                        "disable_web_page_preview": True,
-                    }
-                    
-                    response = self.session.post(url, json=payload, timeout=10)
-                    
-                    if response.status_code == 200:
-                        success_count += 1
-                        logger.debug(f"✅ 发送到 {chat_id[:8]}... 成功")
-                    else:
-                        logger.error(f"❌ 发送到 {chat_id[:8]}... 失败: {response.text}")
-                        
-                except Exception as e:
-                    logger.error(f"发送到 {chat_id[:8]}... 异常: {e}")
+            # 多个接收者并行发送，总耗时取决于最慢的一个而不是逐个累加
+            if len(self.chat_ids) > 1:
+                results = list(self._fanout_pool.map(lambda cid: self._send_one(cid, message), self.chat_ids))
+            else:
+                results = [self._send_one(cid, message) for cid in self.chat_ids]
+            success_count = sum(results)
             
-            EnhancedHealthHandler.metrics.telegram_sent += success_count
+            EnhancedHealthHandler.metrics.incr("telegram_sent", success_count)
             EnhancedHealthHandler.metrics.last_telegram_send = time.time()
             
             return success_count > 0
@@ -641,63 +1197,231 @@ class EmailMonitor:
             logger.error(f"Telegram发送异常: {e}")
             return False
     
+    def _send_one(self, chat_id: str, message: str) -> bool:
+        """向单个会话发送消息，被限流时按 retry_after 等待后重试"""
+        payload = {**self._payload_template, "chat_id": chat_id, "text": message}
+        
+        for attempt in range(Config.TELEGRAM_MAX_RETRIES + 1):
+            # 先取会话令牌再取全局令牌，避免占着全局令牌等待单个会话
+            self._chat_buckets[chat_id].acquire()
+            self._global_bucket.acquire()
+            
+            try:
+                response = self.session.post(self.send_url, json=payload, timeout=Config.TELEGRAM_TIMEOUT)
+            except Exception as e:
+                logger.error(f"发送到 {chat_id[:8]}... 异常: {e}")
+                return False
+            
+            if response.status_code == 200:
+                logger.debug("✅ 发送到 %s... 成功", chat_id[:8])
+                return True
+            
+            if response.status_code == 429 and attempt < Config.TELEGRAM_MAX_RETRIES:
+                # 被限流：按服务器要求的时间推迟后重试；同时暂停全局令牌桶，
+                # 其它会话的发送也一并等待，避免继续触发限流导致封禁时间延长
+                retry_after = self._retry_after(response)
+                self._chat_buckets[chat_id].defer(retry_after)
+                self._global_bucket.defer(retry_after)
+                logger.warning(f"⏳ 发送到 {chat_id[:8]}... 被限流，{retry_after} 秒后重试")
+                continue
+            
+            logger.error(f"❌ 发送到 {chat_id[:8]}... 失败: {response.text}")
+            return False
+        
+        return False
+    
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        """读取 429 响应中要求等待的秒数"""
+        try:
+            retry_after = response.json().get("parameters", {}).get("retry_after")
+        except ValueError:
+            retry_after = None
+        if retry_after is None:
+            retry_after = response.headers.get("Retry-After", 1)
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            return 1.0
+    
+    def search_unseen(self, imap: imaplib.IMAP4_SSL) -> Tuple[List[bytes], Optional[int]]:
+        """搜索最近的未读邮件，返回 (UID列表, 结果中的最大MODSEQ)
+        
+        SINCE 让服务器按索引预先筛选；服务器支持 CONDSTORE 时只搜索基线之后有变化的邮件
+        """
+        since = datetime.now(Config.BEIJING_TZ) - timedelta(days=Config.SEARCH_SINCE_DAYS)
+        criteria = ['UNSEEN', 'SINCE', since.strftime('%d-%b-%Y')]
+        if "CONDSTORE" in imap.capabilities:
+            baseline = self._modseq if self._modseq is not None else 0
+            criteria += ['MODSEQ', str(baseline + 1)]
+        if self._last_uid:
+            criteria += ['UID', f'{self._last_uid + 1}:*']
+        
+        status, messages = imap.uid('SEARCH', None, *criteria)
+        if status != "OK" or not messages or not messages[0]:
+            return [], None
+        
+        # CONDSTORE 服务器会在结果末尾附带 (MODSEQ n)
+        result = messages[0]
+        modseq = None
+        match = re.search(rb'\(MODSEQ (\d+)\)', result)
+        if match:
+            modseq = int(match.group(1))
+            result = result[:match.start()]
+        
+        # "n:*" 在没有更大 UID 时仍会匹配最后一封邮件，需在本地再过滤一次
+        return [uid for uid in result.split() if int(uid) > self._last_uid], modseq
+    
+    def _advance_modseq(self, modseq: Optional[int]):
+        """推进 CONDSTORE 增量搜索基线"""
+        if self._imap is None or "CONDSTORE" not in self._imap.capabilities:
+            return
+        candidates = [m for m in (self._modseq, self._select_modseq, modseq) if m is not None]
+        if candidates:
+            self._modseq = max(candidates)
+    
+    def _load_last_uid(self, uidvalidity: Optional[bytes]) -> int:
+        """读取持久化的 UID 高水位，UIDVALIDITY 不一致时作废"""
+        try:
+            with open(Config.LAST_UID_FILE, encoding="ascii") as f:
+                saved_validity, saved_uid = f.read().split()
+            if uidvalidity and saved_validity == uidvalidity.decode("ascii"):
+                return int(saved_uid)
+        except (OSError, ValueError):
+            pass
+        return 0
+    
+    def _advance_last_uid(self, uids: List[bytes]):
+        """本次搜索结果全部处理完后推进 UID 高水位，并原子地写入文件"""
+        if not uids or not self._uidvalidity:
+            return
+        last_uid = max(int(uid) for uid in uids)
+        if last_uid <= self._last_uid:
+            return
+        self._last_uid = last_uid
+        
+        tmp_path = f"{Config.LAST_UID_FILE}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="ascii") as f:
+                f.write(f"{self._uidvalidity.decode('ascii')} {last_uid}\n")
+            os.replace(tmp_path, Config.LAST_UID_FILE)
+        except OSError as e:
+            logger.warning(f"⚠️ 保存 UID 高水位失败: {e}")
+    
     def check_emails(self) -> bool:
         """检查并处理邮件"""
-        imap = self.connect_imap()
+        imap = self.get_imap()
         if not imap:
             return False
         
         try:
-            # 搜索未读邮件
-            status, messages = imap.search(None, 'UNSEEN')
-            if status != "OK" or not messages[0]:
+            found, modseq = self.search_unseen(imap)
+            uids = found
+            
+            # 已处理但标记已读失败（如连接中断）的邮件：只补标记，不再重复获取、解析和转发
+            done = [uid for uid in found if uid in self._handled_uids]
+            if done:
+                imap.uid('STORE', b",".join(done), '+FLAGS.SILENT', '\\Seen')
+                uids = [uid for uid in found if uid not in self._handled_uids]
+            
+            if not uids:
+                self._advance_modseq(modseq)
+                self._advance_last_uid(found)
                 return True
             
-            email_ids = messages[0].split()
-            processed = 0
+            handled: List[bytes] = []
+            sends: List[Tuple[bytes, EmailInfo, Tuple[str, str], Future]] = []
             forwarded = 0
             
-            # 只处理最新的5封邮件
-            for email_id in email_ids[-5:]:
-                email_info = self.process_email(imap, email_id)
-                if email_info:
-                    processed += 1
-                    
+            # 只处理最新的5封邮件（使用UID，期间有新邮件到达也不会错位）
+            try:
+                for uid, email_info in self.fetch_emails(imap, uids[-5:]):
                     if email_info.code:
-                        # 发送到Telegram
-                        if self.send_to_telegram(email_info):
-                            forwarded += 1
-                            logger.info(f"📤 转发验证码: {email_info.subject} -> {email_info.code}")
-                    
-                    # 标记为已读
-                    imap.store(email_id, '+FLAGS', '\\Seen')
+                        key = email_info.message_id or f"uid:{uid.decode()}"
+                        code_key = self._code_key(email_info)
+                        sent_at = self._forwarded.get(code_key, 0.0)
+                        if key in self._forwarded:
+                            # 上轮已转发但未能标记已读
+                            logger.info(f"⏭️ 跳过已转发的邮件: {email_info.subject}")
+                        elif time.time() - sent_at < Config.DUPLICATE_CODE_WINDOW:
+                            # 同一验证码重复投递（Message-ID 不同或缺失）
+                            logger.info(f"⏭️ 跳过重复的验证码: {email_info.subject}")
+                        else:
+                            self._remember_forwarded(key)
+                            self._remember_forwarded(code_key)
+                            # 提交到发送线程，Telegram 请求与后续邮件的解析并行
+                            future = self._send_pool.submit(self.send_to_telegram, email_info)
+                            sends.append((uid, email_info, (key, code_key), future))
+                            continue
+                    handled.append(uid)
+            finally:
+                # 等待发送结果：只有无需转发或已转发成功的邮件才标记已读，失败的下轮重新处理
+                for uid, email_info, keys, future in sends:
+                    if future.result():
+                        forwarded += 1
+                        handled.append(uid)
+                        logger.info(f"📤 转发验证码: {email_info.subject} -> {email_info.code}")
+                    else:
+                        # 发送失败：移除转发记录，邮件保持未读，下轮重新转发
+                        self._forget_forwarded(keys)
+                
+                for uid in handled:
+                    self._remember_handled(uid)
+                # 一条命令批量标记为已读；SILENT 让服务器不再回送每封邮件的 FETCH FLAGS
+                if handled:
+                    imap.uid('STORE', b",".join(handled), '+FLAGS.SILENT', '\\Seen')
+            
+            processed = len(handled)
+            
+            # 本次结果全部处理完才推进增量基线，未处理的邮件下轮仍能搜到
+            if processed == len(uids):
+                self._advance_modseq(modseq)
+                self._advance_last_uid(found)
             
             if forwarded > 0:
                 logger.info(f"✅ 本轮处理完成: 处理 {processed} 封，转发 {forwarded} 封")
-                EnhancedHealthHandler.metrics.emails_forwarded += forwarded
+                EnhancedHealthHandler.metrics.incr("emails_forwarded", forwarded)
             
             return True
             
         except Exception as e:
             logger.error(f"邮件检查异常: {e}")
+            # 连接状态未知，丢弃后下轮重连
+            self.close_imap()
             return False
-        
-        finally:
-            try:
-                imap.close()
-                imap.logout()
-            except:
-                pass
+    
+    def _remember_handled(self, uid: bytes):
+        """记录已处理的 UID，超过容量时淘汰最早的记录"""
+        self._handled_uids[uid] = None
+        if len(self._handled_uids) > Config.HANDLED_UID_CACHE_SIZE:
+            self._handled_uids.popitem(last=False)
+    
+    @staticmethod
+    def _code_key(email_info: EmailInfo) -> str:
+        """由标题和验证码生成的去重键（定长摘要，避免缓存长标题）"""
+        digest = hashlib.blake2b(f"{email_info.subject}\0{email_info.code}".encode("utf-8"), digest_size=8)
+        return f"code:{digest.hexdigest()}"
+    
+    def _forget_forwarded(self, keys: Tuple[str, ...]):
+        """发送失败时移除转发记录"""
+        for key in keys:
+            self._forwarded.pop(key, None)
+    
+    def _remember_forwarded(self, key: str):
+        """记录已转发的邮件，超过容量时淘汰最早的记录"""
+        self._forwarded[key] = time.time()
+        self._forwarded.move_to_end(key)
+        if len(self._forwarded) > Config.FORWARDED_CACHE_SIZE:
+            self._forwarded.popitem(last=False)
     
     def run(self):
         """主监控循环"""
         logger.info("🚀 邮箱监控服务启动")
         
-        check_interval = Config.CHECK_INTERVAL
-        
-        while True:
+        while not stop_requested():
             try:
-                EnhancedHealthHandler.metrics.email_checks += 1
+                cycle_start = time.monotonic()
+                EnhancedHealthHandler.metrics.incr("email_checks")
                 EnhancedHealthHandler.metrics.last_email_check = time.time()
                 
                 # 执行检查
@@ -707,23 +1431,28 @@ class EmailMonitor:
                     self.error_count = max(0, self.error_count - 1)
                 else:
                     self.error_count += 1
-                    EnhancedHealthHandler.metrics.errors += 1
+                    EnhancedHealthHandler.metrics.incr("errors")
                 
                 # 错误处理
                 if self.error_count >= Config.MAX_ERROR_COUNT:
                     logger.error(f"🚨 连续错误过多，等待 {Config.ERROR_BACKOFF} 秒")
-                    time.sleep(Config.ERROR_BACKOFF)
+                    wait_for_shutdown(Config.ERROR_BACKOFF)
                     self.error_count = Config.MAX_ERROR_COUNT // 2
                 
-                # 等待下次检查
-                time.sleep(check_interval)
+                # 等待新邮件推送（或轮询间隔）
+                self.wait_for_new_mail(time.monotonic() - cycle_start)
                 
             except KeyboardInterrupt:
-                logger.info("👋 收到停止信号，优雅退出")
                 break
             except Exception as e:
                 logger.error(f"监控循环异常: {e}")
-                time.sleep(30)
+                wait_for_shutdown(30)
+        
+        logger.info("👋 收到停止信号，优雅退出")
+        self.close_imap()
+        # 等待已提交的转发发送完成，避免验证码在退出时丢失
+        self._send_pool.shutdown(wait=True)
+        self._fanout_pool.shutdown(wait=True)
 
 # ==================== 主程序入口 ====================
 def banner():
@@ -735,7 +1464,7 @@ def banner():
     print("功能特性:")
     print("  ✓ 精准验证码识别（支持中英文HTML邮件）")
     print("  ✓ 银行卡号后4位提取（支持多种掩码格式）")
-    print("  ✓ 双重防休眠机制（内部+外部保活）")
+    print("  ✓ 外部保活：请在 UptimeRobot 等服务中每5分钟 HEAD 探测健康检查地址")
     print("  ✓ 完整健康检查接口（GET/HEAD/POST）")
     print("  ✓ 实时监控指标和错误统计")
     print("  ✓ 优雅的错误处理和自动恢复")
@@ -752,6 +1481,10 @@ def main():
     
     logger.info("✅ 所有配置验证通过")
     
+    # 平台停止容器时发送 SIGTERM：通知各线程尽快退出，而不是等到被强制结束
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    
     # 2. 启动健康检查服务器（背景线程）
     health_thread = threading.Thread(
         target=run_health_server,
@@ -761,20 +1494,7 @@ def main():
     health_thread.start()
     time.sleep(1)
     
-    # 3. 启动自我唤醒系统（背景线程）
-    try:
-        waker = SelfWaker()
-        wake_thread = threading.Thread(
-            target=waker.run,
-            name="SelfWaker",
-            daemon=True
-        )
-        wake_thread.start()
-        logger.info("✅ 自我唤醒系统已启动")
-    except Exception as e:
-        logger.warning(f"⚠️ 自我唤醒系统启动失败（可继续运行）: {e}")
-    
-    # 4. 启动邮箱监控（主线程）
+    # 3. 启动邮箱监控（主线程）
     try:
         monitor = EmailMonitor()
         monitor.run()
@@ -784,6 +1504,9 @@ def main():
         logger.error(f"💥 服务崩溃: {e}")
         sys.exit(1)
     
+    # 监控循环因异常退出时也要通知健康服务器停止
+    shutdown_event.set()
+    health_thread.join(timeout=2)
     logger.info("服务正常停止")
 
 if __name__ == "__main__":